@@ -0,0 +1,18 @@
+"""
+Environment configuration for the whitelist bot, parsed once at import.
+"""
+
+from pydantic_settings import BaseSettings
+
+
+class Settings(BaseSettings):
+    telegram_token: str = ""
+    admin_ids: str = ""
+    port: int = 10000
+    db_path: str = "whitelist.db"
+
+
+settings = Settings()
+
+# Comma-separated TG user ids, e.g. ADMIN_IDS="123,456"
+ADMIN_IDS = set(int(x.strip()) for x in settings.admin_ids.split(",") if x.strip())
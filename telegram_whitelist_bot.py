@@ -3,20 +3,22 @@ Telegram Whitelist Bot — Solana only + Render keep-alive (web main)
 Fixed for Python 3.13 asyncio event loop
 """
 
-import os
-import re
 import csv
-import sqlite3
+import io
 import logging
+import re
 import threading
 import asyncio
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 from typing import Tuple
 
-from fastapi import FastAPI
+import aiosqlite
+from fastapi import FastAPI, Response
 import uvicorn
 
 from telegram import Update
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     ApplicationBuilder,
     ContextTypes,
@@ -26,64 +28,165 @@ from telegram.ext import (
     ConversationHandler,
 )
 
-DB_PATH = "whitelist.db"
-TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN")
-ADMIN_IDS = set(int(x.strip()) for x in os.environ.get("ADMIN_IDS", "").split(",") if x.strip())
+from settings import ADMIN_IDS, settings
+
+DB_PATH = settings.db_path
+TELEGRAM_TOKEN = settings.telegram_token
 ASKING_ADDRESS = 1
-PORT = int(os.environ.get("PORT", 10000))
+PORT = settings.port
+
+# Compiled once; PTB runs this filter against every incoming text message.
+_WHITELIST_RE = re.compile(r"^!whitelist$", re.IGNORECASE)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- Database helpers ---
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS whitelist (
-            tg_id INTEGER PRIMARY KEY,
-            username TEXT,
-            display_name TEXT,
-            wallet TEXT,
-            updated_at TEXT
+# One long-lived aiosqlite connection instead of a connect/close pair per
+# call: sqlite3.connect() re-parses the schema and loses the page cache each
+# time, and synchronous commits would block the whole PTB event loop.
+# Reads go through a separate read-only connection: query_only skips WAL
+# writer coordination and mmap_size maps the (tiny) DB file into memory so
+# lookups avoid read() syscalls entirely.
+_db: aiosqlite.Connection = None
+_read_db: aiosqlite.Connection = None
+
+# SQL is hoisted to module constants so SQLite's statement cache can reuse
+# the prepared statement instead of re-parsing the text on every call.
+_SET_SQL = (
+    "INSERT INTO whitelist VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT(tg_id) DO UPDATE SET wallet=excluded.wallet, updated_at=excluded.updated_at"
+)
+_EXPORT_SQL = "SELECT tg_id, username, display_name, wallet, updated_at FROM whitelist ORDER BY updated_at DESC"
+
+# Write-through cache: the whitelist is tiny, so repeat lookups (/mywallet,
+# re-entering !whitelist) become a dict hit instead of a SQLite read.
+_wallet_cache: dict[int, Tuple[str, int]] = {}
+
+# Pending upserts are coalesced by a background task so a registration burst
+# costs one fsync per flush interval instead of one per submission.
+_pending: asyncio.Queue = None
+_FLUSH_INTERVAL = 0.2
+
+_CREATE_SQL = """
+    CREATE TABLE IF NOT EXISTS whitelist (
+        tg_id INTEGER PRIMARY KEY,
+        username TEXT,
+        display_name TEXT,
+        wallet TEXT,
+        updated_at INTEGER
+    )
+"""
+
+async def init_db():
+    global _db, _read_db, _pending
+    _pending = asyncio.Queue()
+    _db = await aiosqlite.connect(DB_PATH, isolation_level=None)
+    await _db.execute("PRAGMA journal_mode=WAL")
+    await _db.execute("PRAGMA synchronous=NORMAL")
+    await _db.execute("PRAGMA temp_store=MEMORY")
+    await _db.execute("PRAGMA cache_size=-8000")
+    await _db.execute(_CREATE_SQL)
+    # Databases created before updated_at became INTEGER declare it TEXT,
+    # and column affinity would silently coerce every epoch int we write.
+    # Rebuild the table once, converting ISO strings (and digit strings
+    # written against the old schema) to epoch seconds.
+    async with _db.execute(
+        "SELECT type FROM pragma_table_info('whitelist') WHERE name='updated_at'"
+    ) as c:
+        (col_type,) = await c.fetchone()
+    if col_type != "INTEGER":
+        await _db.execute("BEGIN")
+        await _db.execute("ALTER TABLE whitelist RENAME TO whitelist_legacy")
+        await _db.execute(_CREATE_SQL)
+        await _db.execute(
+            "INSERT INTO whitelist "
+            "SELECT tg_id, username, display_name, wallet, "
+            "COALESCE(CAST(strftime('%s', updated_at) AS INTEGER), CAST(updated_at AS INTEGER)) "
+            "FROM whitelist_legacy"
         )
-    """)
-    conn.commit()
-    conn.close()
-
-def set_wallet(tg_id, username, display_name, wallet):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO whitelist VALUES (?, ?, ?, ?, datetime('now')) "
-        "ON CONFLICT(tg_id) DO UPDATE SET wallet=excluded.wallet, updated_at=datetime('now')",
-        (tg_id, username, display_name, wallet),
+        await _db.execute("DROP TABLE whitelist_legacy")
+        await _db.execute("COMMIT")
+    # Covering index for the export query: ORDER BY updated_at DESC becomes
+    # an index scan with no sort step and no table lookups.
+    await _db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_whitelist_export "
+        "ON whitelist(updated_at DESC, tg_id, username, display_name, wallet)"
     )
-    conn.commit()
-    conn.close()
-
-def get_wallet(tg_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT wallet, updated_at FROM whitelist WHERE tg_id=?", (tg_id,))
-    row = c.fetchone()
-    conn.close()
-    return row if row else (None, None)
-
-def export_csv(path):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT tg_id, username, display_name, wallet, updated_at FROM whitelist ORDER BY updated_at DESC")
-    rows = c.fetchall()
-    conn.close()
-    with open(path, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["tg_id", "username", "display_name", "wallet", "updated_at"])
-        writer.writerows(rows)
+    _read_db = await aiosqlite.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    await _read_db.execute("PRAGMA query_only=1")
+    await _read_db.execute("PRAGMA mmap_size=268435456")
+    # Preload the whole whitelist in one sequential scan so lookups never
+    # fall back to per-user SQLite probes, even for first-time traffic.
+    async with _read_db.execute("SELECT tg_id, wallet, updated_at FROM whitelist") as c:
+        async for tg_id, wallet, ts in c:
+            _wallet_cache[tg_id] = (wallet, ts)
+
+async def set_wallet(tg_id, username, display_name, wallet):
+    # Epoch seconds: no allocation or formatting on the write path, an
+    # 8-byte column instead of a ~27-byte ISO string, and integer compares
+    # in the export's ORDER BY. Formatting happens only at export time.
+    now = int(time.time())
+    # Ack from the cache immediately; the flusher persists the row shortly.
+    _wallet_cache[tg_id] = (wallet, now)
+    _pending.put_nowait((tg_id, username, display_name, wallet, now))
+
+async def _flush_writes():
+    batch = []
+    try:
+        while True:
+            if not batch:
+                batch.append(await _pending.get())
+            await asyncio.sleep(_FLUSH_INTERVAL)
+            while not _pending.empty():
+                batch.append(_pending.get_nowait())
+            try:
+                await _db.execute("BEGIN")
+                await _db.executemany(_SET_SQL, batch)
+                await _db.execute("COMMIT")
+                batch = []
+            except Exception:
+                # Keep the batch (newer rows append behind it, preserving
+                # upsert order) and retry next interval; users were already
+                # acked from the cache.
+                logger.exception("Wallet flush of %d row(s) failed; retrying", len(batch))
+                try:
+                    await _db.execute("ROLLBACK")
+                except Exception:
+                    pass
+    except asyncio.CancelledError:
+        # Hand unflushed rows back to the queue for the shutdown drain.
+        for row in batch:
+            _pending.put_nowait(row)
+        raise
+
+async def get_wallet(tg_id):
+    # The cache is preloaded in init_db() and written through by
+    # set_wallet, so lookups never touch SQLite.
+    return _wallet_cache.get(tg_id, (None, None))
+
+async def export_csv():
+    buf = io.StringIO(newline="")
+    writer = csv.writer(buf)
+    writer.writerow(["tg_id", "username", "display_name", "wallet", "updated_at"])
+    async with _read_db.execute(_EXPORT_SQL) as c:
+        c.arraysize = 1000
+        async for tg_id, username, display_name, wallet, ts in c:
+            if isinstance(ts, int):
+                ts = datetime.fromtimestamp(ts, timezone.utc).isoformat()
+            writer.writerow((tg_id, username, display_name, wallet, ts))
+    return io.BytesIO(buf.getvalue().encode())
 
 # --- Solana validation ---
-SOLANA_RE = re.compile(r"^[1-9A-HJ-NP-Za-km-z]{32,44}$")
-def is_valid_wallet(addr): return bool(SOLANA_RE.fullmatch(addr.strip()))
+# Length check + base58 alphabet scan, equivalent to the old
+# ^[1-9A-HJ-NP-Za-km-z]{32,44}$ regex. bytes.translate walks the string
+# once in C against a 256-entry table, so there is no per-char Python
+# work even at spam-scale inbound rates.
+_B58_BYTES = b"123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+def is_valid_wallet(s):
+    # Takes an already-stripped address; callers strip exactly once.
+    return 32 <= len(s) <= 44 and not s.encode().translate(None, delete=_B58_BYTES)
 
 # --- Telegram bot logic ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -91,7 +194,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def whitelist_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    current, _ = get_wallet(user.id)
+    current, _ = await get_wallet(user.id)
     if current:
         await update.message.reply_text(f"You already have `{current}`. Use /editwallet to change it.")
         return ConversationHandler.END
@@ -104,23 +207,26 @@ async def whitelist_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def receive_address(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     text = update.message.text.strip()
-    mention = f"@{user.username}" if user.username else user.full_name
+    # full_name is a property that concatenates first/last on every access;
+    # bind it once per update.
+    full_name = user.full_name
+    mention = f"@{user.username}" if user.username else full_name
 
     if not is_valid_wallet(text):
         await update.message.reply_text(f"{mention}, ❌ invalid address. Try again or /cancel.")
         return ASKING_ADDRESS
 
-    set_wallet(user.id, user.username, user.full_name, text)
+    await set_wallet(user.id, user.username, full_name, text)
     await update.message.reply_text(f"✅ {mention}, your wallet has been added to the whitelist!")
     return ConversationHandler.END
 
 async def editwallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    current, _ = get_wallet(update.effective_user.id)
+    current, _ = await get_wallet(update.effective_user.id)
     await update.message.reply_text(f"Current: `{current}`\nSend new address or /cancel.")
     return ASKING_ADDRESS
 
 async def mywallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    current, _ = get_wallet(update.effective_user.id)
+    current, _ = await get_wallet(update.effective_user.id)
     await update.message.reply_text(f"Your wallet: `{current}`" if current else "No wallet yet. Type !whitelist.")
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -128,25 +234,58 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in ADMIN_IDS:
-        await update.message.reply_text("Not authorized.")
-        return
-    path = "whitelist_export.csv"
-    export_csv(path)
-    await update.message.reply_document(open(path, "rb"))
-
-async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.text.strip().lower() == "!whitelist":
-        return await whitelist_entry(update, context)
+    buf = await export_csv()
+    await update.message.reply_document(document=buf, filename="whitelist_export.csv")
 
 # --- Bot runner ---
+_flush_task: asyncio.Task = None
+
+async def _post_init(app):
+    # Open the shared DB connection and start the write flusher on the
+    # bot's event loop.
+    global _flush_task
+    await init_db()
+    _flush_task = app.create_task(_flush_writes())
+
+async def _post_shutdown(app):
+    # Stop the flusher and persist anything still queued so acked writes
+    # aren't lost inside the 200ms coalescing window on shutdown.
+    if _flush_task:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+    batch = []
+    while not _pending.empty():
+        batch.append(_pending.get_nowait())
+    if batch:
+        try:
+            await _db.execute("BEGIN")
+            await _db.executemany(_SET_SQL, batch)
+            await _db.execute("COMMIT")
+        except Exception:
+            logger.exception("Final wallet flush of %d row(s) failed", len(batch))
+    await _db.close()
+    await _read_db.close()
+
 def start_bot():
-    init_db()
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).concurrent_updates(True).build()
+    # HTTP/2 multiplexes replies over one TLS connection to api.telegram.org;
+    # the big pool and generous pool_timeout avoid connection churn in bursts.
+    request = HTTPXRequest(connection_pool_size=64, http_version="2", pool_timeout=10.0)
+    app = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .request(request)
+        .concurrent_updates(True)
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
 
     conv = ConversationHandler(
         entry_points=[CommandHandler("whitelist", whitelist_entry),
-                      MessageHandler(filters.TEXT & filters.Regex(r"(?i)^!whitelist$"), whitelist_entry)],
+                      MessageHandler(filters.TEXT & filters.Regex(_WHITELIST_RE), whitelist_entry)],
         states={ASKING_ADDRESS: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_address)]},
         fallbacks=[CommandHandler("cancel", cancel)],
         allow_reentry=True,
@@ -156,8 +295,9 @@ def start_bot():
     app.add_handler(conv)
     app.add_handler(CommandHandler("editwallet", editwallet))
     app.add_handler(CommandHandler("mywallet", mywallet))
-    app.add_handler(CommandHandler("export", export_cmd))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, unknown))
+    # Admin check at the filter layer: non-admin /export calls are dropped
+    # during dispatch instead of invoking the handler coroutine.
+    app.add_handler(CommandHandler("export", export_cmd, filters=filters.User(user_id=list(ADMIN_IDS))))
 
     logger.info("Starting Telegram bot polling...")
 
@@ -170,18 +310,26 @@ def start_bot():
 # --- FastAPI keep-alive ---
 fastapi_app = FastAPI()
 
+# The keep-alive pinger hits these constantly; precomputed bodies skip JSON
+# serialization (and jsonable_encoder) entirely on every request.
+_ROOT_RESP = Response(content=b'{"status":"ok"}', media_type="application/json")
+_PING_RESP = Response(content=b'{"pong":true}', media_type="application/json")
+
 @fastapi_app.get("/")
-def root(): return {"status": "ok"}
+def root(): return _ROOT_RESP
 
 @fastapi_app.get("/ping")
-def ping(): return {"pong": True}
+def ping(): return _PING_RESP
 
 def main():
     if not TELEGRAM_TOKEN:
         raise RuntimeError("Missing TELEGRAM_TOKEN.")
     threading.Thread(target=start_bot, daemon=True).start()
     logger.info("Starting FastAPI keep-alive server...")
-    uvicorn.run(fastapi_app, host="0.0.0.0", port=PORT)
+    # uvloop + httptools replace the pure-Python event loop and HTTP parser;
+    # the access log is off so keep-alive pings stop writing a line each.
+    uvicorn.run(fastapi_app, host="0.0.0.0", port=PORT,
+                loop="uvloop", http="httptools", access_log=False)
 
 if __name__ == "__main__":
     main()